@@ -1,8 +1,91 @@
-import json
+import orjson
+import time
+import functools
+import threading
+from collections import deque
 import streamlit as st
-import google.generativeai as genai
 from google.api_core.exceptions import ResourceExhausted
 
+# Google AI Studio default quota profile and retry policy for 429s
+GEMINI_RPM_LIMIT = 60
+GEMINI_TPM_LIMIT = 100_000
+GEMINI_MAX_RETRIES = 3
+
+# Flash handles the short, bounded generations; Pro is reserved for structured resume extraction
+DEFAULT_MODEL = "gemini-1.5-flash"
+RESUME_MODEL = "gemini-1.5-pro"
+
+class RateLimiter:
+    """
+    Sliding-window limiter for requests- and tokens-per-minute quotas.
+    Calls wait until the window has room instead of tripping a 429, and the
+    request budget backs off multiplicatively on 429s and recovers additively on success.
+    """
+    def __init__(self, rpm: int, tpm: int, window: float = 60.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.window = window
+        self.request_limit = rpm
+        self.request_times = deque()
+        self.tokens_used = 0
+        self.tokens_window_start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: int) -> float:
+        """Records the request and returns 0 if it fits in the window, otherwise the seconds to wait."""
+        # Shared by every session thread in the process, so the check-and-record must be atomic
+        with self._lock:
+            now = time.monotonic()
+            while self.request_times and now - self.request_times[0] >= self.window:
+                self.request_times.popleft()
+            if now - self.tokens_window_start >= self.window:
+                self.tokens_window_start = now
+                self.tokens_used = 0
+
+            delay = 0.0
+            if len(self.request_times) >= self.request_limit:
+                delay = self.window - (now - self.request_times[0])
+            if self.tokens_used and self.tokens_used + tokens > self.tpm:
+                delay = max(delay, self.window - (now - self.tokens_window_start))
+            if delay > 0:
+                return delay
+
+            self.request_times.append(now)
+            self.tokens_used += tokens
+            return 0.0
+
+    def wait(self, tokens: int):
+        """Blocks until the request fits within the quota."""
+        delay = self._reserve(tokens)
+        while delay:
+            time.sleep(delay)
+            delay = self._reserve(tokens)
+
+    def on_success(self):
+        with self._lock:
+            self.request_limit = min(self.rpm, self.request_limit + 1)
+
+    def on_throttled(self):
+        with self._lock:
+            self.request_limit = max(1, self.request_limit // 2)
+
+_RATE_LIMITER = RateLimiter(GEMINI_RPM_LIMIT, GEMINI_TPM_LIMIT)
+
+def estimate_tokens(prompt: str) -> int:
+    """Rough prompt token count (~4 characters per token)."""
+    return len(prompt) // 4
+
+# genai.configure and the model cache are process-wide, so the key they were built for is tracked here too
+_configured_key = None
+_configure_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=4)
+def _get_model(name: str, json_mode: bool):
+    """Returns a shared GenerativeModel so every agent call reuses one instance (and its client) per config."""
+    import google.generativeai as genai # Deferred: only needed once an API key is configured
+    generation_config = {"response_mime_type": "application/json"} if json_mode else None
+    return genai.GenerativeModel(name, generation_config=generation_config)
+
 # Configure the LLM using Streamlit secrets/state
 def configure_genai():
     api_key = ""
@@ -14,34 +97,93 @@ def configure_genai():
     if not api_key:
         api_key = st.session_state.get("gemini_api_key", "")
         
-    if api_key:
-        genai.configure(api_key=api_key)
-        return True
-    return False
+    if not api_key:
+        return False
+
+    # Only reconfigure when the key changes (from any session); cached models hold clients bound to the old key
+    global _configured_key
+    with _configure_lock:
+        if _configured_key != api_key:
+            import google.generativeai as genai # Deferred to keep the SDK off the cold-start path
+            genai.configure(api_key=api_key)
+            _get_model.cache_clear()
+            _configured_key = api_key
+    return True
 
-def call_gemini_with_fallback(prompt: str, fallback_response: str, json_format=False) -> str:
-    """Wraps Gemini API calls in a try-except block to gracefully degrade if quota is exceeded."""
+def warm_up_genai() -> bool:
+    """Configures the SDK and builds the resume model ahead of the first call, so that cost can overlap other work."""
     if not configure_genai():
-        return fallback_response
+        return False
+    _get_model(RESUME_MODEL, True)
+    return True
 
-    try:
-        if json_format:
-            model = genai.GenerativeModel("gemini-1.5-flash", generation_config={"response_mime_type": "application/json"})
-        else:
-            model = genai.GenerativeModel("gemini-1.5-pro")
-            
-        response = model.generate_content(prompt)
-        return response.text
-    except ResourceExhausted:
-        st.warning("Gemini API Quota Exceeded (429). Using Fallback Template Engine.")
-        return fallback_response
-    except Exception as e:
-        st.error(f"Gemini API Error: {str(e)}")
-        return fallback_response
-
-def parse_resume_agent(resume_text: str) -> dict:
-    """Parses resume text and returns structured JSON {role, skills, experience_level}"""
-    prompt = f"""
+def _generate(prompt: str, json_format=False, model_name: str = DEFAULT_MODEL):
+    """Runs a rate-limited, retried Gemini call; returns the response text, or None if the caller should fall back."""
+    if not configure_genai():
+        return None
+
+    model = _get_model(model_name, json_format)
+    tokens = estimate_tokens(prompt)
+    for attempt in range(GEMINI_MAX_RETRIES + 1):
+        _RATE_LIMITER.wait(tokens)
+        try:
+            response = model.generate_content(prompt)
+            _RATE_LIMITER.on_success()
+            return response.text
+        except ResourceExhausted:
+            _RATE_LIMITER.on_throttled()
+            if attempt < GEMINI_MAX_RETRIES:
+                time.sleep(2 ** attempt)
+        except Exception as e:
+            st.error(f"Gemini API Error: {str(e)}")
+            return None
+
+    st.warning("Gemini API Quota Exceeded (429). Using Fallback Template Engine.")
+    return None
+
+def call_gemini_with_fallback(prompt: str, fallback_response: str, json_format=False,
+                              model_name: str = DEFAULT_MODEL, stream=False):
+    """
+    Wraps Gemini API calls in a rate-limited retry loop to gracefully degrade if quota is still exceeded.
+    Returns the response text, or an iterator of text chunks when stream=True.
+    """
+    if stream:
+        if not configure_genai():
+            return iter([fallback_response])
+        return _stream_gemini(_get_model(model_name, json_format), prompt, fallback_response)
+
+    response = _generate(prompt, json_format=json_format, model_name=model_name)
+    return fallback_response if response is None else response
+
+def _stream_gemini(model, prompt: str, fallback_response: str):
+    """Yields response text chunks as they arrive, with the same throttling and fallback as call_gemini_with_fallback."""
+    tokens = estimate_tokens(prompt)
+    for attempt in range(GEMINI_MAX_RETRIES + 1):
+        _RATE_LIMITER.wait(tokens)
+        started = False
+        try:
+            for chunk in model.generate_content(prompt, stream=True):
+                started = True
+                yield chunk.text
+            _RATE_LIMITER.on_success()
+            return
+        except ResourceExhausted:
+            _RATE_LIMITER.on_throttled()
+            if started:
+                return # Keep the partial text rather than repeating it on retry
+            if attempt < GEMINI_MAX_RETRIES:
+                time.sleep(2 ** attempt)
+        except Exception as e:
+            st.error(f"Gemini API Error: {str(e)}")
+            if not started:
+                yield fallback_response
+            return
+
+    st.warning("Gemini API Quota Exceeded (429). Using Fallback Template Engine.")
+    yield fallback_response
+
+# Prompt templates are module constants, filled per call with str.format
+_RESUME_PROMPT = """
     Analyze the following resume and extract the key information into a JSON format.
     The output must strictly be a JSON object with the following keys:
     - "role": The primary job title or role described (e.g., "Full-Stack Engineer", "Data Scientist").
@@ -51,69 +193,136 @@ def parse_resume_agent(resume_text: str) -> dict:
     Resume Text:
     {resume_text}
     """
-    
-    fallback_json = json.dumps({
-        "role": "Software Engineer", 
-        "skills": ["Python", "Problem Solving", "Communication"], 
-        "experience_level": "Mid"
-    })
-    
-    response = call_gemini_with_fallback(prompt, fallback_response=fallback_json, json_format=True)
-    
-    try:
-        return json.loads(response)
-    except json.JSONDecodeError:
-        return json.loads(fallback_json)
 
-def job_discovery_agent(role: str, location: str) -> list:
-    """Simulates job discovery and returns 3 mock opportunities."""
-    prompt = f"""
+_JOB_PROMPT = """
     Generate exactly 3 mock job opportunities for a {role} in {location}.
     Return output as a JSON array of objects. Each object must have:
     - "company_name": Fictional tech company name.
     - "job_title": The specific role title.
     - "contact_email": <company>@example.recruiting.com
     """
-    
-    fallback_json = json.dumps([
-        {"company_name": "TechNova Solutions", "job_title": f"Senior {role}", "contact_email": "careers@technova.example.com"},
-        {"company_name": "Quantum Innovations", "job_title": f"Lead {role}", "contact_email": "hr@quantuminnovations.example.com"},
-        {"company_name": "CloudNine Systems", "job_title": f"{role}", "contact_email": "jobs@cloudninesystems.example.com"}
-    ])
-    
-    response = call_gemini_with_fallback(prompt, fallback_response=fallback_json, json_format=True)
-    
-    try:
-        return json.loads(response)
-    except json.JSONDecodeError:
-        return json.loads(fallback_json)
 
-def cover_letter_agent(candidate_info: dict, company_name: str, job_title: str) -> str:
-    """Generates a highly personalized cover letter."""
-    prompt = f"""
+_COVER_PROMPT = """
     Write a professional and hyper-personalized cover letter.
-    Candidate Role: {candidate_info.get('role')}
-    Candidate Experience Level: {candidate_info.get('experience_level')}
-    Candidate Skills: {', '.join(candidate_info.get('skills', []))}
+    Candidate Role: {role}
+    Candidate Experience Level: {experience_level}
+    Candidate Skills: {skills}
     
     Target Company: {company_name}
     Target Job Title: {job_title}
     
     Keep it concise, structured, and persuasive. Do not use placeholders like [Your Name]. Use placeholder tags like <CANDIDATE_NAME> instead if needed.
     """
+
+_BATCH_COVER_PROMPT = """
+    Write a professional and hyper-personalized cover letter for each of the target jobs listed below.
+    Candidate Role: {role}
+    Candidate Experience Level: {experience_level}
+    Candidate Skills: {skills}
     
-    fallback_text = f"Dear Hiring Manager at {company_name},\n\nI am writing to express my strong interest in the {job_title} role. With my background in {candidate_info.get('role')} and experience in {', '.join(candidate_info.get('skills', [])[:3])}, I am confident I would be a valuable addition to your team.\n\nPlease find my resume attached.\n\nBest regards,\nA Dedicated Professional"
+    Target Jobs:
+{targets}
     
-    return call_gemini_with_fallback(prompt, fallback_response=fallback_text)
+    Keep each letter concise, structured, and persuasive. Do not use placeholders like [Your Name]. Use placeholder tags like <CANDIDATE_NAME> instead if needed.
+    Return output as a JSON object of the form {{"letters": [{{"company": "<company name>", "text": "<cover letter>"}}]}} with one entry per target job.
+    """
 
-def interview_prep_agent(role: str) -> str:
-    """Generates 10 tailored interview questions based on the role."""
-    prompt = f"""
+_BATCH_TARGET_LINE = "    - Company: {company_name} | Job Title: {job_title}"
+
+_PREP_PROMPT = """
     Generate exactly 10 tailored interview preparation questions for a {role} position.
     Include a mix of technical, behavioral, and architectural questions appropriate for this role.
     Format as a numbered markdown list.
     """
+
+_PREP_FALLBACK = "1. Tell me about yourself.\n2. What are your greatest strengths?\n3. Describe a challenging project you worked on.\n4. How do you handle tight deadlines?\n5. Where do you see yourself in 5 years?\n6. Why do you want to work here?\n7. Describe a time you disagreed with a coworker.\n8. How do you stay updated with industry trends?\n9. What is your preferred work environment?\n10. Do you have any questions for us?"
+
+# Serialized once; parsed into a fresh dict per call since callers mutate the result
+_RESUME_FALLBACK_JSON = orjson.dumps({
+    "role": "Software Engineer", 
+    "skills": ["Python", "Problem Solving", "Communication"], 
+    "experience_level": "Mid"
+}).decode()
+
+def _candidate_fields(candidate_info: dict) -> dict:
+    """Candidate profile fields shared by the cover-letter prompts."""
+    return {
+        "role": candidate_info.get('role'),
+        "experience_level": candidate_info.get('experience_level'),
+        "skills": ', '.join(candidate_info.get('skills', [])),
+    }
+
+def parse_resume_agent(resume_text: str) -> tuple:
+    """
+    Parses resume text and returns (structured JSON {role, skills, experience_level}, used_fallback).
+    used_fallback is True when the template profile was returned instead of an LLM result.
+    """
+    prompt = _RESUME_PROMPT.format(resume_text=resume_text)
     
-    fallback_text = "1. Tell me about yourself.\n2. What are your greatest strengths?\n3. Describe a challenging project you worked on.\n4. How do you handle tight deadlines?\n5. Where do you see yourself in 5 years?\n6. Why do you want to work here?\n7. Describe a time you disagreed with a coworker.\n8. How do you stay updated with industry trends?\n9. What is your preferred work environment?\n10. Do you have any questions for us?"
+    response = _generate(prompt, json_format=True, model_name=RESUME_MODEL)
+    
+    if response is not None:
+        try:
+            return orjson.loads(response), False
+        except orjson.JSONDecodeError:
+            pass
+    return orjson.loads(_RESUME_FALLBACK_JSON), True
+
+def job_discovery_agent(role: str, location: str) -> list:
+    """Simulates job discovery and returns 3 mock opportunities."""
+    prompt = _JOB_PROMPT.format(role=role, location=location)
+    
+    fallback_jobs = [
+        {"company_name": "TechNova Solutions", "job_title": f"Senior {role}", "contact_email": "careers@technova.example.com"},
+        {"company_name": "Quantum Innovations", "job_title": f"Lead {role}", "contact_email": "hr@quantuminnovations.example.com"},
+        {"company_name": "CloudNine Systems", "job_title": f"{role}", "contact_email": "jobs@cloudninesystems.example.com"}
+    ]
+    
+    response = call_gemini_with_fallback(prompt, fallback_response=orjson.dumps(fallback_jobs).decode(), json_format=True)
+    
+    try:
+        return orjson.loads(response)
+    except orjson.JSONDecodeError:
+        return fallback_jobs
+
+def _fallback_cover_letter(candidate_info: dict, company_name: str, job_title: str) -> str:
+    """Template cover letter used whenever the LLM is unavailable."""
+    return f"Dear Hiring Manager at {company_name},\n\nI am writing to express my strong interest in the {job_title} role. With my background in {candidate_info.get('role')} and experience in {', '.join(candidate_info.get('skills', [])[:3])}, I am confident I would be a valuable addition to your team.\n\nPlease find my resume attached.\n\nBest regards,\nA Dedicated Professional"
+
+def cover_letter_agent_stream(candidate_info: dict, company_name: str, job_title: str):
+    """Generates a highly personalized cover letter, yielding text chunks as they arrive."""
+    prompt = _COVER_PROMPT.format(company_name=company_name, job_title=job_title, **_candidate_fields(candidate_info))
+    
+    fallback_text = _fallback_cover_letter(candidate_info, company_name, job_title)
+    
+    return call_gemini_with_fallback(prompt, fallback_response=fallback_text, stream=True)
+
+def cover_letters_batch_agent(candidate_info: dict, jobs: list) -> dict:
+    """Generates cover letters for every job in a single request and returns {company_name: letter}."""
+    targets = "\n".join(
+        _BATCH_TARGET_LINE.format(company_name=job.get('company_name'), job_title=job.get('job_title')) for job in jobs
+    )
+    prompt = _BATCH_COVER_PROMPT.format(targets=targets, **_candidate_fields(candidate_info))
+    
+    fallback_letters = {
+        job.get("company_name"): _fallback_cover_letter(candidate_info, job.get("company_name"), job.get("job_title"))
+        for job in jobs
+    }
+    fallback_json = orjson.dumps({"letters": [{"company": company, "text": text} for company, text in fallback_letters.items()]}).decode()
+    
+    response = call_gemini_with_fallback(prompt, fallback_response=fallback_json, json_format=True)
+    
+    try:
+        letters = orjson.loads(response).get("letters", [])
+        return {item["company"]: item["text"] for item in letters if item.get("company") and item.get("text")}
+    except (orjson.JSONDecodeError, AttributeError, TypeError, KeyError):
+        return fallback_letters
+
+def interview_prep_agent(role: str) -> tuple:
+    """Generates 10 tailored interview questions based on the role; returns (questions, used_fallback)."""
+    prompt = _PREP_PROMPT.format(role=role)
     
-    return call_gemini_with_fallback(prompt, fallback_response=fallback_text)
+    response = _generate(prompt)
+    if response is None:
+        return _PREP_FALLBACK, True
+    return response, False
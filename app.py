@@ -1,25 +1,80 @@
 import streamlit as st
-import time
+import asyncio
 import os
-import pandas as pd
+import hashlib
+import concurrent.futures
+from dataclasses import dataclass
 from datetime import datetime
+from pathlib import Path
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # Local imports
-from utils import extract_text_from_pdf, send_email_with_attachment
-from agents import parse_resume_agent, job_discovery_agent, cover_letter_agent, interview_prep_agent
+from utils import extract_text_from_pdf, build_attachment_part, build_email_with_attachment, EmailDispatcher
+from agents import warm_up_genai, parse_resume_agent, job_discovery_agent, cover_letter_agent_stream, cover_letters_batch_agent, interview_prep_agent
 
 # Constants
 COMPANY_NAME = "TOPS Technologies"
+MAX_LOG_RECORDS = 500 # older log lines are evicted past this
+VISIBLE_LOG_LINES = 50
+
+@dataclass
+class LogRecord:
+    """A single terminal log line; rendered to HTML only when displayed."""
+    __slots__ = ("ts", "msg", "color")
+    ts: str
+    msg: str
+    color: str
+
+@st.cache_resource(show_spinner=False)
+def _load_css(css_path: str):
+    """Reads the stylesheet once per process; returns None if it is missing."""
+    path = Path(css_path)
+    if not path.exists():
+        return None
+    return path.read_text()
 
 def inject_custom_css():
     """Injects custom CSS for styling and animations."""
-    css_path = os.path.join(os.path.dirname(__file__), "style.css")
-    if os.path.exists(css_path):
-        with open(css_path, "r") as f:
-            st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+    css = _load_css(os.path.join(os.path.dirname(__file__), "style.css"))
+    if css is not None:
+        st.markdown(f"<style>{css}</style>", unsafe_allow_html=True)
     else:
         st.warning("style.css not found, using default styles.")
 
+class _FallbackResult(Exception):
+    """Raised out of a cached wrapper so st.cache_data never stores (or replays) a template fallback."""
+    def __init__(self, value):
+        super().__init__("LLM fallback used")
+        self.value = value
+
+# Only real LLM results are cached, keyed by the PDF hash / role. The leading-underscore arg is
+# excluded from Streamlit's cache key.
+@st.cache_data(show_spinner=False, max_entries=16)
+def _cached_parse_llm(pdf_hash: str, _resume_text: str) -> dict:
+    candidate_info, used_fallback = parse_resume_agent(_resume_text)
+    if used_fallback:
+        raise _FallbackResult(candidate_info)
+    return candidate_info
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _cached_interview_prep_llm(role: str) -> str:
+    prep_guide, used_fallback = interview_prep_agent(role)
+    if used_fallback:
+        raise _FallbackResult(prep_guide)
+    return prep_guide
+
+def _cached_parse(pdf_hash: str, resume_text: str) -> dict:
+    try:
+        return _cached_parse_llm(pdf_hash, resume_text)
+    except _FallbackResult as fallback:
+        return fallback.value
+
+def _cached_interview_prep(role: str) -> str:
+    try:
+        return _cached_interview_prep_llm(role)
+    except _FallbackResult as fallback:
+        return fallback.value
+
 def init_session_state():
     """Initializes necessary variables in session state."""
     defaults = {
@@ -32,54 +87,141 @@ def init_session_state():
         "interview_questions": None,
         "pdf_bytes": None,
         "pdf_filename": None,
+        "pdf_hash": None,
         "workflow_started": False,
-        "workflow_completed": False
+        "workflow_completed": False,
+        "log_placeholder": None
     }
     for key, val in defaults.items():
         if key not in st.session_state:
             st.session_state[key] = val
 
 def append_log(message: str, error=False, fallback=False):
-    """Appends a new line to the terminal logs and updates stats."""
+    """Appends a new line to the terminal logs, updates stats and refreshes the live terminal."""
     timestamp = datetime.now().strftime("%H:%M:%S")
     color = "red" if error else "#0288d1"
     if fallback:
         st.session_state.api_fallbacks += 1
         color = "orange"
         
-    log_html = f"<div class='terminal-line'><span class='terminal-time'>[{timestamp}]</span> <span style='color: {color}'>{message}</span></div>"
-    st.session_state.logs.append(log_html)
+    logs = st.session_state.logs
+    logs.append(LogRecord(timestamp, message, color))
+    if len(logs) > MAX_LOG_RECORDS:
+        del logs[:-MAX_LOG_RECORDS]
+    render_logs()
 
 def render_logs():
-    """Renders the execution logs widget."""
-    logs_html = "".join(st.session_state.logs[-50:]) # keep last 50
-    if not st.session_state.logs:
+    """Renders the execution logs widget into the log placeholder."""
+    placeholder = st.session_state.log_placeholder
+    if placeholder is None or not st.session_state.logs:
         return # Do not render the large white box if there are no logs
         
-    st.markdown(f"""
+    logs_html = "".join(
+        f"<div class='terminal-line'><span class='terminal-time'>[{r.ts}]</span> <span style='color: {r.color}'>{r.msg}</span></div>"
+        for r in st.session_state.logs[-VISIBLE_LOG_LINES:]
+    )
+    placeholder.markdown(f"""
         <div class="terminal-container">
             <div class="terminal-body" id="terminal-body">
                 {logs_html}
             </div>
         </div>
     """, unsafe_allow_html=True)
-    
+
+def inject_autoscroll():
+    """Registers a single observer that keeps the terminal scrolled to the latest line as it updates."""
     # Execute JS via Streamlit Components to handle auto-scroll in the parent DOM
     import streamlit.components.v1 as components
     components.html("""
         <script>
             try {
-                var d = window.parent.document.getElementById("terminal-body");
-                if (d) {
-                    d.scrollTop = d.scrollHeight;
-                }
+                var doc = window.parent.document;
+                var scrollTerminal = function () {
+                    var d = doc.getElementById("terminal-body");
+                    if (d) {
+                        d.scrollTop = d.scrollHeight;
+                    }
+                };
+                new MutationObserver(scrollTerminal).observe(doc.body, {childList: true, subtree: true});
+                scrollTerminal();
             } catch (e) {}
         </script>
     """, height=0)
 
+def preview_cover_letters(mock_jobs: list, candidate_info: dict, letters: dict) -> list:
+    """Shows a preview of each job's cover letter, streaming one in only if the batch missed that company."""
+    cover_letters = []
+    for index, job in enumerate(mock_jobs):
+        company = job.get("company_name", f"Company {index+1}")
+        title = job.get("job_title", "Software Engineer")
+        
+        st.markdown(f"**Generated Letter for {company}:**")
+        cover_letter = letters.get(company)
+        if cover_letter:
+            st.text_area("Cover Letter Preview", value=cover_letter, height=150, key=f"cl_{index}", disabled=True)
+        else:
+            append_log(f"Generating hyper-personalized cover letter targeting {title} at {company}...")
+            cover_letter = st.write_stream(cover_letter_agent_stream(candidate_info, company, title))
+        
+        if cover_letter.startswith("Dear") and "A Dedicated Professional" in cover_letter:
+            append_log(f"Notice: Used fallback template for cover letter to {company}.", fallback=True)
+        cover_letters.append(cover_letter)
+    return cover_letters
+
+async def process_job(index: int, job: dict, total: int, candidate_info: dict, cover_letter: str,
+                      dispatcher: EmailDispatcher, pdf_part):
+    """Dispatches the application for a single job."""
+    company = job.get("company_name", f"Company {index+1}")
+    title = job.get("job_title", "Software Engineer")
+    recipient = job.get("contact_email", "hr@example.com")
+    
+    append_log(f"--- Processing {index+1}/{total}: {company} ---")
+    
+    # 3.2 & 3.3: Attach PDF and Dispatch (with rate limiting / logs inside the SMTP handler)
+    append_log(f"Preparing dispatch to {recipient} (Sends are spaced at least 20s apart)...")
+    st.toast(f"Queued dispatch to {company}...")
+    
+    subject = f"Application for {title} - {candidate_info.get('role')}"
+    
+    # We simulate sending if it's an example.com to avoid actually bothering real servers unless real email is provided.
+    if "example" in recipient:
+        append_log(f"Mocking sent email to {recipient} (Simulated 3s delay)...")
+        await asyncio.sleep(3)
+        success = True
+    else:
+        msg = build_email_with_attachment(
+            sender_email=dispatcher.sender_email,
+            recipient_email=recipient,
+            subject=subject,
+            body=cover_letter,
+            attachment_part=pdf_part
+        )
+        success = await dispatcher.send(msg)
+    
+    if success:
+        st.session_state.successful_dispatches += 1
+        append_log(f"Successfully dispatched application to {company} ✅")
+    else:
+        append_log(f"Failed to dispatch to {company} ❌", error=True)
+
+async def dispatch_applications(mock_jobs: list, candidate_info: dict, cover_letters: list,
+                                sender_email: str, app_password: str):
+    """Runs every job's dispatch concurrently over one shared SMTP connection."""
+    # The resume is identical for every job, so it is encoded into a MIME part only once
+    pdf_part = None
+    if st.session_state.pdf_bytes:
+        pdf_part = build_attachment_part(st.session_state.pdf_bytes, st.session_state.pdf_filename)
+    
+    async with EmailDispatcher(sender_email, app_password) as dispatcher:
+        await asyncio.gather(*[
+            process_job(index, job, len(mock_jobs), candidate_info, cover_letter, dispatcher, pdf_part)
+            for index, (job, cover_letter) in enumerate(zip(mock_jobs, cover_letters))
+        ])
+
 def main():
     st.set_page_config(page_title=f"{COMPANY_NAME} Agent AI", page_icon="🤖", layout="wide")
     inject_custom_css()
+    inject_autoscroll()
     init_session_state()
 
     # --- Header ---
@@ -122,13 +264,22 @@ def main():
     uploaded_file = st.file_uploader("Upload your resume (PDF)", type=["pdf"])
 
     if uploaded_file is not None:
-        if st.session_state.pdf_filename != uploaded_file.name:
-            st.session_state.pdf_bytes = uploaded_file.getvalue()
+        # Compare content, not filename, so a re-uploaded edit of the same file is picked up
+        pdf_bytes = uploaded_file.getvalue()
+        pdf_hash = hashlib.blake2b(pdf_bytes, digest_size=16).hexdigest()
+        if st.session_state.pdf_hash != pdf_hash:
+            st.session_state.pdf_bytes = pdf_bytes
             st.session_state.pdf_filename = uploaded_file.name
+            st.session_state.pdf_hash = pdf_hash
             st.session_state.parsed_resume = None
             st.session_state.workflow_started = False
             
-    if st.button("Start Agentic Workflow", disabled=(not uploaded_file)):
+    start_workflow = st.button("Start Agentic Workflow", disabled=(not uploaded_file))
+    
+    # Live terminal: append_log streams new lines into this placeholder while the workflow runs
+    st.session_state.log_placeholder = st.empty()
+    
+    if start_workflow:
         if not sender_email or not app_password:
             st.error("Please configure your Sender Email and App Password in the sidebar.")
             append_log("Workflow aborted: Missing SMTP credentials", error=True)
@@ -142,7 +293,14 @@ def main():
         # Step 1: Intelligent Parsing
         with st.spinner("Extracting text and parsing with Gemini..."):
             append_log("Reading PDF Resume...")
-            resume_text = extract_text_from_pdf(uploaded_file)
+            # Extract on a worker thread (attached to this script run so st.error still renders)
+            # while the Gemini SDK is imported and configured for the parse that follows
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=1, initializer=add_script_run_ctx, initargs=(None, get_script_run_ctx())
+            ) as pool:
+                extraction = pool.submit(extract_text_from_pdf, uploaded_file)
+                warm_up_genai()
+                resume_text = extraction.result()
             
             if not resume_text:
                 append_log("Failed to extract text from PDF.", error=True)
@@ -150,7 +308,7 @@ def main():
                 return
                 
             append_log("Analyzing resume content via LLM Agent...")
-            candidate_info = parse_resume_agent(resume_text)
+            candidate_info = _cached_parse(st.session_state.pdf_hash, resume_text)
             
             # Apply Override Logic
             if manual_role_input:
@@ -172,61 +330,24 @@ def main():
             append_log(f"Discovered {len(mock_jobs)} targeted opportunities.")
             
             st.markdown("#### Discovered Opportunities")
-            st.dataframe(pd.DataFrame(mock_jobs))
+            st.dataframe(mock_jobs, column_order=["company_name", "job_title", "contact_email"])
 
         # Step 3: The Dispatch Loop
         st.markdown("#### Dispatching Applications")
         dispatch_container = st.empty()
         
-        for index, job in enumerate(mock_jobs):
-            company = job.get("company_name", f"Company {index+1}")
-            title = job.get("job_title", "Software Engineer")
-            recipient = job.get("contact_email", "hr@example.com")
-            
-            with st.spinner(f"Processing Application for {company}..."):
-                append_log(f"--- Processing {index+1}/{len(mock_jobs)}: {company} ---")
-                
-                # 3.1: Generate Cover Letter
-                append_log(f"Generating hyper-personalized cover letter targeting {title} at {company}...")
-                cover_letter = cover_letter_agent(candidate_info, company, title)
-                if cover_letter.startswith("Dear") and "A Dedicated Professional" in cover_letter:
-                    append_log("Notice: Used fallback template for cover letter.", fallback=True)
-                
-                st.markdown(f"**Generated Letter for {company}:**")
-                st.text_area("Cover Letter Preview", value=cover_letter, height=150, key=f"cl_{index}", disabled=True)
-                
-                # 3.2 & 3.3: Attach PDF and Dispatch (with rate limiting / logs inside smtplib handler)
-                append_log(f"Preparing dispatch to {recipient} (Includes 20s rate limit buffer)...")
-                st.toast(f"Waiting 20 seconds before dispatching to {company}...")
-                
-                subject = f"Application for {title} - {candidate_info.get('role')}"
-                
-                # We simulate sending if it's an example.com to avoid actually bothering real servers unless real email is provided.
-                if "example" in recipient:
-                    append_log(f"Mocking sent email to {recipient} (Simulated 3s delay)...")
-                    time.sleep(3)
-                    success = True
-                else:
-                    success = send_email_with_attachment(
-                        sender_email=sender_email,
-                        app_password=app_password,
-                        recipient_email=recipient,
-                        subject=subject,
-                        body=cover_letter,
-                        attachment_bytes=st.session_state.pdf_bytes,
-                        filename=st.session_state.pdf_filename
-                    )
-                
-                if success:
-                    st.session_state.successful_dispatches += 1
-                    append_log(f"Successfully dispatched application to {company} ✅")
-                else:
-                    append_log(f"Failed to dispatch to {company} ❌", error=True)
+        with st.spinner("Generating cover letters..."):
+            append_log(f"Generating hyper-personalized cover letters for {len(mock_jobs)} opportunities in one batch...")
+            letters = cover_letters_batch_agent(candidate_info, mock_jobs)
+        cover_letters = preview_cover_letters(mock_jobs, candidate_info, letters)
+        
+        with st.spinner(f"Processing {len(mock_jobs)} applications concurrently..."):
+            asyncio.run(dispatch_applications(mock_jobs, candidate_info, cover_letters, sender_email, app_password))
 
         # Step 4: Post-Process Value
         with st.spinner("Generating Interview Prep Guide..."):
             append_log("Initializing Post-Process Action: Interview Prep Agent...")
-            prep_guide = interview_prep_agent(candidate_info.get("role"))
+            prep_guide = _cached_interview_prep(candidate_info.get("role"))
             st.session_state.interview_questions = prep_guide
             append_log("Interview Guide ready.")
         
@@ -240,7 +361,7 @@ def main():
         st.markdown("Based on your targeted roles, here are 10 tailored interview questions:")
         st.info(st.session_state.interview_questions)
 
-    # Always render logs at the end so it stays at the bottom
+    # Re-render the terminal with the session's logs on plain reruns
     render_logs()
 
 if __name__ == "__main__":
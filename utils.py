@@ -1,31 +1,66 @@
 import time
-import smtplib
+import asyncio
+import threading
+import aiosmtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.application import MIMEApplication
-from pypdf import PdfReader
 import streamlit as st
 
+# Minimum spacing between two real SMTP sends
+SMTP_SEND_INTERVAL = 20.0
+
+class SMTPRateLimit:
+    """
+    Spaces SMTP sends from the same sender account at least `interval` seconds apart,
+    only waiting if that account's last send was recent.
+    """
+    def __init__(self, interval: float = SMTP_SEND_INTERVAL):
+        self.interval = interval
+        self._next_slot = {}
+        # Shared by every session thread in the process; each Streamlit run drives its own event loop
+        self._lock = threading.Lock()
+
+    def _reserve(self, account: str) -> float:
+        """Claims the account's next send slot and returns the seconds to wait for it."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(account, now))
+            self._next_slot[account] = slot + self.interval
+            return slot - now
+
+    async def acquire(self, account: str):
+        delay = self._reserve(account)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+smtp_limiter = SMTPRateLimit()
+
 def extract_text_from_pdf(pdf_file) -> str:
     """Extracts text from an uploaded PDF file."""
+    from pypdf import PdfReader # Deferred until a resume is actually uploaded
     try:
         reader = PdfReader(pdf_file)
-        text = ""
+        parts = []
         for page in reader.pages:
             extract = page.extract_text()
             if extract:
-                text += extract + "\n"
-        return text
+                parts.append(extract)
+        # Join once instead of re-copying the accumulated text on every page
+        return "\n".join(parts) + ("\n" if parts else "")
     except Exception as e:
         st.error(f"Error parsing PDF: {e}")
         return ""
 
-def send_email_with_attachment(sender_email: str, app_password: str, recipient_email: str, 
-                               subject: str, body: str, attachment_bytes: bytes, filename: str) -> bool:
-    """
-    Sends an email with an attachment using Gmail's SMTP server.
-    Implements 20s rate limiting and error handling for Auth.
-    """
+def build_attachment_part(attachment_bytes: bytes, filename: str) -> MIMEApplication:
+    """Base64-encodes the resume into a MIME part once so it can be attached to every application."""
+    part = MIMEApplication(attachment_bytes, Name=filename)
+    part['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return part
+
+def build_email_with_attachment(sender_email: str, recipient_email: str, subject: str, body: str,
+                                attachment_part: MIMEApplication = None) -> MIMEMultipart:
+    """Builds the application email, attaching the prebuilt resume part if given."""
     msg = MIMEMultipart()
     msg['From'] = sender_email
     msg['To'] = recipient_email
@@ -33,25 +68,78 @@ def send_email_with_attachment(sender_email: str, app_password: str, recipient_e
     
     msg.attach(MIMEText(body, 'plain'))
     
-    if attachment_bytes:
-        part = MIMEApplication(attachment_bytes, Name=filename)
-        part['Content-Disposition'] = f'attachment; filename="{filename}"'
-        msg.attach(part)
-        
-    try:
-        # Rate limiting rule application: Sleep 20s before sending
-        st.info(f"Rate limiting: Waiting 20 seconds before dispatching email to {recipient_email}...")
-        time.sleep(20)
-        
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(sender_email, app_password)
-        server.send_message(msg)
-        server.quit()
+    if attachment_part is not None:
+        msg.attach(attachment_part)
+    return msg
+
+class EmailDispatcher:
+    """
+    Sends emails over a single authenticated Gmail SMTP connection shared by a whole workflow run.
+    The connection is opened on the first send (so fully mocked runs never log in), reused for
+    every later send, and re-established once if the server drops it.
+    Implements 20s rate limiting between sends and error handling for Auth.
+    """
+    def __init__(self, sender_email: str, app_password: str, hostname: str = 'smtp.gmail.com', port: int = 587):
+        self.sender_email = sender_email
+        self.app_password = app_password
+        self.hostname = hostname
+        self.port = port
+        self.server = None
+        self.auth_failed = False
+        self._connect_lock = None
+
+    async def __aenter__(self):
+        self._connect_lock = asyncio.Lock()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self.server is not None and self.server.is_connected:
+            try:
+                await self.server.quit()
+            except aiosmtplib.SMTPException:
+                pass
+        self.server = None
+
+    async def _connect(self):
+        server = aiosmtplib.SMTP(hostname=self.hostname, port=self.port, start_tls=True)
+        await server.connect()
+        try:
+            await server.login(self.sender_email, self.app_password)
+        except Exception:
+            server.close()
+            raise
+        self.server = server
+
+    async def _ensure_connected(self) -> bool:
+        """Connects if needed; returns False without touching the server once a login has been rejected."""
+        async with self._connect_lock:
+            if self.auth_failed:
+                return False
+            if self.server is None or not self.server.is_connected:
+                try:
+                    await self._connect()
+                except aiosmtplib.SMTPAuthenticationError:
+                    # Don't retry bad credentials: repeated failed logins can get the Gmail account locked
+                    self.auth_failed = True
+                    raise
         return True
-    except smtplib.SMTPAuthenticationError:
-        st.error("SMTP Authentication Error: Please verify your Email and App Password.")
-        return False
-    except Exception as e:
-        st.error(f"Failed to send email: {str(e)}")
-        return False
+
+    async def send(self, msg: MIMEMultipart) -> bool:
+        try:
+            if not await self._ensure_connected():
+                return False
+            # Rate limiting rule application: keep this account's sends at least 20s apart
+            await smtp_limiter.acquire(self.sender_email)
+            try:
+                await self.server.send_message(msg)
+            except aiosmtplib.SMTPServerDisconnected:
+                if not await self._ensure_connected():
+                    return False
+                await self.server.send_message(msg)
+            return True
+        except aiosmtplib.SMTPAuthenticationError:
+            st.error("SMTP Authentication Error: Please verify your Email and App Password.")
+            return False
+        except Exception as e:
+            st.error(f"Failed to send email: {str(e)}")
+            return False